@@ -1,10 +1,14 @@
 import os
-import re
 import json
+import operator
 import hashlib
-from datetime import datetime
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, Set
 
 from flask import Flask, render_template, request, jsonify
 from werkzeug.utils import secure_filename
@@ -17,6 +21,13 @@ try:
 except Exception:  # pragma: no cover
     ANDRO_OK = False
 
+# Optional: faster JSON encoding for responses, falls back to Flask's jsonify
+try:
+    import orjson
+    ORJSON_OK = True
+except Exception:  # pragma: no cover
+    ORJSON_OK = False
+
 
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_DIR = BASE_DIR / "uploads"
@@ -24,9 +35,74 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {"apk"}
 
+# Permissions flagged as dangerous (exact names)
+DANGEROUS_PERMS = frozenset({
+    "android.permission.SEND_SMS",
+    "android.permission.READ_SMS",
+    "android.permission.RECEIVE_SMS",
+    "android.permission.CALL_PHONE",
+    "android.permission.RECORD_AUDIO",
+    "android.permission.READ_CONTACTS",
+    "android.permission.WRITE_CONTACTS",
+    "android.permission.READ_CALL_LOG",
+    "android.permission.WRITE_CALL_LOG",
+    "android.permission.READ_EXTERNAL_STORAGE",
+    "android.permission.WRITE_EXTERNAL_STORAGE",
+    "android.permission.MANAGE_EXTERNAL_STORAGE",
+    "android.permission.ACCESS_FINE_LOCATION",
+    "android.permission.ACCESS_COARSE_LOCATION",
+    "android.permission.SYSTEM_ALERT_WINDOW",
+    "android.permission.REQUEST_INSTALL_PACKAGES",
+    "android.permission.PACKAGE_USAGE_STATS",
+    "android.permission.CAMERA",
+})
+
+# Certificate attributes reported in findings (one C-level fetch per cert)
+_CERT_FIELDS = operator.attrgetter("issuer", "subject", "serial_number")
+
+# Characters allowed after the scheme of an extracted URL (plus any
+# Unicode alphanumeric, mirroring the ``\w`` of the former regex)
+URL_CHARS = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    "_-.~:/?#[]@!$&'()*+,;=%"
+)
+# Android XML namespace URIs (android:, app:, tools:) sit in every manifest's
+# string pool; they are not endpoints the app talks to
+ANDROID_NS_PREFIX = "http://schemas.android.com/"
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+# APKs at or above this size are analyzed in a worker process so the CPU-bound
+# androguard parse does not hold the GIL of the serving worker; smaller ones
+# are analyzed inline to skip the IPC round trip
+INLINE_ANALYSIS_MAX = 5 * 1024 * 1024  # 5 MB
+ANALYSIS_TIMEOUT = 300  # seconds
+# Concurrent analysis processes per server worker (render.yaml runs two of them)
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+
+# Large chunks keep each hashlib update() inside OpenSSL longer (SHA-NI on
+# OpenSSL 1.1.1+ capable CPUs) and amortize the Python -> C call per chunk
+HASH_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+
+# Analysis processes are started from a forkserver (spawn where unavailable)
+# rather than forked from the multi-threaded server worker, whose other
+# threads may hold locks the child would inherit
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _mp = multiprocessing.get_context("forkserver")
+    _mp.set_forkserver_preload(["flask", "androguard.core.bytecodes.apk"])
+else:  # pragma: no cover
+    _mp = multiprocessing.get_context("spawn")
+_analysis_slots = threading.BoundedSemaphore(ANALYSIS_WORKERS)
+
+# Successful analyses keyed by APK SHA-256, least recently used evicted first
+RESULT_CACHE_SIZE = 128
+_result_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_result_cache_lock = threading.Lock()
+
 app = Flask(__name__, static_folder="static", template_folder="templates")
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 100 MB
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_DIR)
+# Set KEEP_UPLOADS=0 to delete each APK once it has been analyzed
+app.config["KEEP_UPLOADS"] = os.environ.get("KEEP_UPLOADS", "1") != "0"
 
 
 @app.errorhandler(RequestEntityTooLarge)
@@ -38,16 +114,41 @@ def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def to_jsonable(o: Any) -> Any:
-    """Recursively convert objects to JSON-serializable structures.
-    - dict -> dict with jsonable values
-    - list/tuple/set -> list
-    - Path -> str
-    - bytes -> utf-8 string (errors ignored)
-    - other objects -> str(o)
-    """
-    from collections.abc import Mapping, Iterable
+def extract_urls(text: str) -> Iterator[str]:
+    """Yield http(s) URLs found in text.
 
+    Linear scan: locate each ``http`` prefix (case-insensitive), check for
+    ``://`` or ``s://`` and then walk forward over URL characters.
+    """
+    # Most manifest strings and file names contain no URL at all; bail out
+    # before allocating the case-folded copy ("://" needs no folding)
+    if "://" not in text:
+        return
+    folded = text.translate(_ASCII_LOWER)
+    n = len(text)
+    i = 0
+    while True:
+        j = folded.find("http", i)
+        if j < 0:
+            return
+        k = j + 4
+        if folded.startswith("s", k):
+            k += 1
+        if not folded.startswith("://", k):
+            i = j + 4
+            continue
+        k += 3
+        start = k
+        while k < n and (text[k] in URL_CHARS or text[k].isalnum()):
+            k += 1
+        if k == start:
+            i = j + 4
+            continue
+        yield text[j:k]
+        i = k
+
+
+def _jsonable_leaf(o: Any) -> Any:
     if o is None or isinstance(o, (bool, int, float, str)):
         return o
     if isinstance(o, Path):
@@ -57,10 +158,6 @@ def to_jsonable(o: Any) -> Any:
             return o.decode("utf-8", errors="ignore")
         except Exception:
             return str(o)
-    if isinstance(o, Mapping):
-        return {str(k): to_jsonable(v) for k, v in o.items()}
-    if isinstance(o, (list, tuple, set)):
-        return [to_jsonable(i) for i in o]
     # Fallback: string representation
     try:
         return str(o)
@@ -68,6 +165,53 @@ def to_jsonable(o: Any) -> Any:
         return repr(o)
 
 
+def to_jsonable(o: Any) -> Any:
+    """Convert objects to JSON-serializable structures.
+    - dict -> dict with jsonable values
+    - list/tuple/set -> list
+    - Path -> str
+    - bytes -> utf-8 string (errors ignored)
+    - other objects -> str(o)
+    Nested containers are walked with an explicit stack instead of recursion.
+    """
+    if not isinstance(o, (Mapping, list, tuple, set)):
+        return _jsonable_leaf(o)
+
+    root: Any = {} if isinstance(o, Mapping) else []
+    stack = [(o, root)]
+    while stack:
+        src, dst = stack.pop()
+        items = ((str(k), v) for k, v in src.items()) if isinstance(src, Mapping) else enumerate(src)
+        for k, v in items:
+            if isinstance(v, Mapping):
+                child: Any = {}
+                stack.append((v, child))
+            elif isinstance(v, (list, tuple, set)):
+                child = []
+                stack.append((v, child))
+            else:
+                child = _jsonable_leaf(v)
+            if isinstance(dst, dict):
+                dst[k] = child
+            else:
+                dst.append(child)
+    return root
+
+
+def fast_jsonify(obj: Any, status: int = 200):
+    """Build a JSON response, encoded with orjson when it is installed."""
+    if ORJSON_OK:
+        body = orjson.dumps(obj, default=to_jsonable, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+        return app.response_class(body, status=status, mimetype="application/json")
+    # analyze_apk only returns plain values; convert if something slipped through
+    try:
+        resp = jsonify(obj)
+    except TypeError:
+        resp = jsonify(to_jsonable(obj))
+    resp.status_code = status
+    return resp
+
+
 def analyze_apk(apk_path: Path) -> Dict[str, Any]:
     if not ANDRO_OK:
         return {
@@ -76,6 +220,9 @@ def analyze_apk(apk_path: Path) -> Dict[str, Any]:
         }
 
     try:
+        # The path is passed rather than an mmap with raw=True: androguard
+        # copies the input into a bytearray either way, and raw=True adds a
+        # full SHA-256 pass over it.
         a = APK(str(apk_path))
     except Exception as e:
         return {"ok": False, "error": f"Failed to parse APK: {e}"}
@@ -98,53 +245,45 @@ def analyze_apk(apk_path: Path) -> Dict[str, Any]:
     permissions = sorted(set(a.get_permissions() or []))
     findings["permissions"] = permissions
 
-    dangerous_perm_prefixes = (
-        "android.permission.SEND_SMS",
-        "android.permission.READ_SMS",
-        "android.permission.RECEIVE_SMS",
-        "android.permission.CALL_PHONE",
-        "android.permission.RECORD_AUDIO",
-        "android.permission.READ_CONTACTS",
-        "android.permission.WRITE_CONTACTS",
-        "android.permission.READ_CALL_LOG",
-        "android.permission.WRITE_CALL_LOG",
-        "android.permission.READ_EXTERNAL_STORAGE",
-        "android.permission.WRITE_EXTERNAL_STORAGE",
-        "android.permission.MANAGE_EXTERNAL_STORAGE",
-        "android.permission.ACCESS_FINE_LOCATION",
-        "android.permission.ACCESS_COARSE_LOCATION",
-        "android.permission.SYSTEM_ALERT_WINDOW",
-        "android.permission.REQUEST_INSTALL_PACKAGES",
-        "android.permission.PACKAGE_USAGE_STATS",
-        "android.permission.CAMERA",
-    )
-    dangerous_perms = [p for p in permissions if any(p.startswith(dp) for dp in dangerous_perm_prefixes)]
-    findings["dangerous_permissions"] = sorted(dangerous_perms)
+    dangerous_perms_set = DANGEROUS_PERMS.intersection(permissions)
+    dangerous_perms = sorted(dangerous_perms_set)
+    findings["dangerous_permissions"] = dangerous_perms
 
     # Receivers / Services that may indicate background behavior
     try:
-        findings["receivers"] = a.get_receivers() or []
+        findings["receivers"] = list(map(str, a.get_receivers() or []))
     except Exception:
         findings["receivers"] = []
 
     try:
-        findings["services"] = a.get_services() or []
+        findings["services"] = list(map(str, a.get_services() or []))
     except Exception:
         findings["services"] = []
 
     try:
-        findings["activities"] = a.get_activities() or []
+        findings["activities"] = list(map(str, a.get_activities() or []))
     except Exception:
         findings["activities"] = []
 
     # URL extraction from manifest and files (very lightweight)
-    urls: List[str] = []
-    url_regex = re.compile(r"https?://[\w\-._~:/?#\[\]@!$&'()*+,;=%]+", re.IGNORECASE)
+    urls: Set[str] = set()
 
-    # Search in manifest xml
+    # Search in manifest: walk the binary XML string pool directly instead of
+    # serializing the whole document; fall back to the XML text if the
+    # installed androguard does not expose it
     try:
-        manifest_xml = a.get_android_manifest_xml().toxml() if hasattr(a.get_android_manifest_xml(), 'toxml') else str(a.get_android_manifest_xml())
-        urls += url_regex.findall(manifest_xml or "")
+        try:
+            string_pool = a.get_android_manifest_axml().axml.sb
+        except AttributeError:
+            string_pool = None
+        if string_pool is not None:
+            for s in string_pool:
+                if isinstance(s, str) and not s.startswith(ANDROID_NS_PREFIX):
+                    urls.update(extract_urls(s))
+        else:
+            mx = a.get_android_manifest_xml()
+            manifest_xml = mx.toxml() if hasattr(mx, 'toxml') else str(mx)
+            urls.update(u for u in extract_urls(manifest_xml or "") if not u.startswith(ANDROID_NS_PREFIX))
     except Exception:
         pass
 
@@ -152,13 +291,11 @@ def analyze_apk(apk_path: Path) -> Dict[str, Any]:
     try:
         for f in a.get_files():
             if isinstance(f, str):
-                urls += url_regex.findall(f)
+                urls.update(extract_urls(f))
     except Exception:
         pass
 
-    # Deduplicate urls
-    urls = sorted(set(urls))
-    findings["urls"] = urls
+    findings["urls"] = sorted(urls)
 
     # Cert info (coarse)
     try:
@@ -166,9 +303,7 @@ def analyze_apk(apk_path: Path) -> Dict[str, Any]:
         cert_list = []
         for c in (certs or []):
             try:
-                issuer = getattr(c, "issuer", None)
-                subject = getattr(c, "subject", None)
-                serial = getattr(c, "serial_number", None)
+                issuer, subject, serial = _CERT_FIELDS(c)
                 cert_list.append({
                     "issuer": str(issuer) if issuer is not None else None,
                     "subject": str(subject) if subject is not None else None,
@@ -196,10 +331,12 @@ def analyze_apk(apk_path: Path) -> Dict[str, Any]:
     if len(urls) > 10:
         risk += 1
         reasons.append("Lots of embedded URLs (possible trackers/endpoints)")
-    if any("SYSTEM_ALERT_WINDOW" in p for p in dangerous_perms):
+    has_saw = "android.permission.SYSTEM_ALERT_WINDOW" in dangerous_perms_set
+    has_rip = "android.permission.REQUEST_INSTALL_PACKAGES" in dangerous_perms_set
+    if has_saw:
         risk += 1
         reasons.append("Can draw over other apps (SYSTEM_ALERT_WINDOW)")
-    if any("REQUEST_INSTALL_PACKAGES" in p for p in dangerous_perms):
+    if has_rip:
         risk += 1
         reasons.append("Can request to install packages (side-loading)")
 
@@ -238,14 +375,106 @@ def index():
     return render_template("index.html")
 
 
-def sha256_file(path: Path) -> str:
+def _analyze_in_child(apk_path: Path, conn) -> None:
+    try:
+        conn.send(analyze_apk(apk_path))
+    except Exception as e:
+        conn.send({"ok": False, "error": f"Failed to analyze APK: {e}"})
+    finally:
+        conn.close()
+
+
+def run_analysis(apk_path: Path) -> Dict[str, Any]:
+    if apk_path.stat().st_size < INLINE_ANALYSIS_MAX:
+        return analyze_apk(apk_path)
+
+    # One process per parse, so a hung or crashed parse can be killed without
+    # affecting other requests
+    with _analysis_slots:
+        recv_conn, send_conn = _mp.Pipe(duplex=False)
+        proc = _mp.Process(target=_analyze_in_child, args=(apk_path, send_conn), daemon=True)
+        proc.start()
+        send_conn.close()
+        try:
+            if not recv_conn.poll(ANALYSIS_TIMEOUT):
+                return {"ok": False, "error": "Analysis timed out"}
+            return recv_conn.recv()
+        except EOFError:
+            # The child died (e.g. OOM-killed) before sending results
+            return {"ok": False, "error": "Analysis process exited unexpectedly"}
+        finally:
+            recv_conn.close()
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+
+
+def cached_analysis(digest: str, apk_path: Path) -> Dict[str, Any]:
+    """Return analysis results for an APK, reusing them for repeat uploads."""
+    with _result_cache_lock:
+        cached = _result_cache.get(digest)
+        if cached is not None:
+            _result_cache.move_to_end(digest)
+            return dict(cached)
+
+    results = run_analysis(apk_path)
+    if results.get("ok"):
+        with _result_cache_lock:
+            _result_cache[digest] = results
+            _result_cache.move_to_end(digest)
+            while len(_result_cache) > RESULT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+    return dict(results)
+
+
+def save_and_hash(file, path: Path) -> str:
+    """Write an uploaded file to path, hashing it in the same pass.
+
+    Returns the SHA-256 hex digest of the written bytes.
+    """
     h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
-            h.update(chunk)
+    # Write to a temporary name in the same directory and move it into place,
+    # so a partially written upload never appears under its final name
+    # (created with 0666 so the umask applies, as with a plain open())
+    tmp_path = path.with_name(path.name + ".part")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with open(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
     return h.hexdigest()
 
 
+def release_upload(path: Path) -> None:
+    """Drop an analyzed upload from the page cache, or delete it unless KEEP_UPLOADS."""
+    if not app.config["KEEP_UPLOADS"]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        return
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            fd = os.open(str(path), os.O_RDONLY)
+            try:
+                # DONTNEED skips dirty pages, and an upload analyzed right
+                # after saving is usually still dirty; write it back first
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+
  
 
 
@@ -262,23 +491,19 @@ def upload():
         return jsonify({"ok": False, "error": "Only .apk files are allowed"}), 400
 
     filename = secure_filename(file.filename)
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
-    save_name = f"{ts}_{filename}"
+    save_name = f"{time.time_ns()}_{filename}"
     save_path = UPLOAD_DIR / save_name
-    file.save(str(save_path))
+    # SHA-256 is computed while saving to avoid a second read of the file
+    digest = save_and_hash(file, save_path)
 
-    results = analyze_apk(save_path)
-    results["filename"] = filename
-
-    # Optionally compute SHA-256 if you want to display it later (VT removed)
     try:
-        results["sha256"] = sha256_file(save_path)
-    except Exception:
-        pass
+        results = cached_analysis(digest, save_path)
+    finally:
+        release_upload(save_path)
+    results["filename"] = filename
+    results["sha256"] = digest
 
-    # Ensure JSON-serializable
-    safe_results = to_jsonable(results)
-    return jsonify(safe_results)
+    return fast_jsonify(results)
 
 
 if __name__ == "__main__":